@@ -20,7 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-VALID_PAGE_SIZES = (1, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+VALID_PAGE_SIZES = frozenset((1, 512, 1024, 2048, 4096, 8192, 16384, 32768))
 
 SQLITE_TABLE_COLUMNS = {
     'sqlite_master': ('type', 'name', 'tbl_name', 'rootpage', 'sql',),
@@ -31,6 +31,9 @@ SQLITE_TABLE_COLUMNS = {
     'sqlite_stat4': ('tbl', 'idx', 'nEq', 'nLt', 'nDLt', 'sample'),
 }
 
+# The collections of page types below are only ever used for membership
+# tests, hence the frozensets
+
 # These are the integers used in ptrmap entries to designate the kind of page
 # for which a given ptrmap entry holds a notional "child to parent" pointer
 BTREE_ROOT_PAGE = 1
@@ -39,18 +42,18 @@ FIRST_OFLOW_PAGE = 3
 NON_FIRST_OFLOW_PAGE = 4
 BTREE_NONROOT_PAGE = 5
 
-PTRMAP_PAGE_TYPES = (
+PTRMAP_PAGE_TYPES = frozenset((
     BTREE_ROOT_PAGE,
     FREELIST_PAGE,
     FIRST_OFLOW_PAGE,
     NON_FIRST_OFLOW_PAGE,
     BTREE_NONROOT_PAGE,
-)
+))
 
-OVERFLOW_PAGE_TYPES = (
+OVERFLOW_PAGE_TYPES = frozenset((
     FIRST_OFLOW_PAGE,
     NON_FIRST_OFLOW_PAGE,
-)
+))
 
 # These are identifiers used internally to keep track of page types *before*
 # specialised objects can be instantiated
@@ -59,14 +62,14 @@ FREELIST_LEAF_PAGE = 'freelist_leaf'
 PTRMAP_PAGE = 'ptrmap_page'
 UNKNOWN_PAGE = 'unknown'
 
-FREELIST_PAGE_TYPES = (
+FREELIST_PAGE_TYPES = frozenset((
     FREELIST_TRUNK_PAGE,
     FREELIST_LEAF_PAGE,
-)
+))
 
-NON_BTREE_PAGE_TYPES = (
+NON_BTREE_PAGE_TYPES = frozenset((
     FREELIST_TRUNK_PAGE,
     FIRST_OFLOW_PAGE,
     NON_FIRST_OFLOW_PAGE,
     PTRMAP_PAGE,
-)
+))
@@ -20,6 +20,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import array
+import itertools
+import mmap
 import os
 import re
 import stat
@@ -40,18 +43,49 @@ from .tuples import (
 
 signatures = {}
 
+# The DB header is always big-endian
+_HEADER_STRUCT = struct.Struct(r'>16sHBBBBBBIIIIIIIIIIII20xII')
+_FREELIST_TRUNK_STRUCT = struct.Struct(r'>II')
+_PTRMAP_ENTRY_STRUCT = struct.Struct(r'>BI')
+
+_CREATE_TABLE_RE = re.compile(r'^CREATE TABLE (\S+) \((.*)\)$', re.DOTALL)
+_BETWEEN_PARENS_RE = re.compile(r'\([^)]+\)')
+
+
+class _LazyPages(dict):
+    # Generic Page objects are only built when somebody asks for a page that
+    # hasn't been given a specialised object yet. They aren't stored, as
+    # they're meant to be replaced as parsing progresses.
+    def __init__(self, db):
+        super().__init__()
+        self._db = db
+
+    def __missing__(self, page_idx):
+        if not 1 <= page_idx <= self._db.size_in_pages:
+            raise KeyError(page_idx)
+        return Page(page_idx, self._db)
+
 
 class SQLite_DB(object):
     def __init__(self, path, heuristics_registry):
         self._path = path
         self._page_types = {}
-        self._header = self.parse_header()
         self._registry = heuristics_registry
-
+        self._mmap = None
         self._page_cache = None
         # Actual page objects go here
-        self._pages = {}
-        self.build_page_cache()
+        self._pages = _LazyPages(self)
+
+        # The header and page cache are both read from the same file handle
+        with open(self._path, 'br') as sqlite:
+            self._header = self.parse_header(sqlite)
+            self.build_page_cache(sqlite)
+        # The header is immutable once parsed, these are derived from it and
+        # used in a few hot paths
+        self._page_size = self._header.page_size
+        self._usable_size = \
+            self._header.page_size - self._header.reserved_length
+        self._size_in_pages = self._header.size_in_pages
 
         self._ptrmap = {}
 
@@ -60,7 +94,8 @@ class SQLite_DB(object):
         self._page_tables = {}
         self._tables = {}
         self._table_columns = {}
-        self._freelist_leaves = []
+        # Page numbers are 32-bit, no need for a list of int objects
+        self._freelist_leaves = array.array('I')
         self._freelist_btree_pages = []
 
     @property
@@ -71,10 +106,26 @@ class SQLite_DB(object):
     def header(self):
         return self._header
 
+    @property
+    def page_size(self):
+        return self._page_size
+
+    @property
+    def usable_size(self):
+        return self._usable_size
+
+    @property
+    def size_in_pages(self):
+        return self._size_in_pages
+
     @property
     def pages(self):
         return self._pages
 
+    @property
+    def heuristics_registry(self):
+        return self._registry
+
     @property
     def tables(self):
         return self._tables
@@ -88,10 +139,10 @@ class SQLite_DB(object):
         return self._table_columns
 
     def page_bytes(self, page_idx):
-        try:
-            return self._page_cache[page_idx]
-        except KeyError as ex:
-            raise ValueError(f"No cache for page {page_idx}") from ex
+        if not 1 <= page_idx <= self._size_in_pages:
+            raise ValueError(f"No cache for page {page_idx}")
+        page_offset = (page_idx - 1) * self._page_size
+        return self._page_cache[page_offset:page_offset + self._page_size]
 
     def map_table_page(self, page_idx, table):
         assert isinstance(page_idx, int)
@@ -100,10 +151,7 @@ class SQLite_DB(object):
 
     def get_page_table(self, page_idx):
         assert isinstance(page_idx, int)
-        try:
-            return self._page_tables[page_idx]
-        except KeyError:
-            return None
+        return self._page_tables.get(page_idx)
 
     def __repr__(self):
         return '<SQLite DB, page count: {} | page size: {}>'.format(
@@ -111,21 +159,14 @@ class SQLite_DB(object):
             self.header.page_size
         )
 
-    def parse_header(self):
-        header_bytes = None
-        file_size = None
-        with open(self._path, 'br') as sqlite:
-            header_bytes = sqlite.read(100)
-            file_size = os.fstat(sqlite.fileno())[stat.ST_SIZE]
+    def parse_header(self, sqlite):
+        header_bytes = sqlite.read(100)
+        file_size = os.fstat(sqlite.fileno())[stat.ST_SIZE]
 
         if not header_bytes:
             raise ValueError("Couldn't read SQLite header")
         assert isinstance(header_bytes, bytes)
-        # This DB header is always big-endian
-        fields = SQLite_header(*struct.unpack(
-            r'>16sHBBBBBBIIIIIIIIIIII20xII',
-            header_bytes[:100]
-        ))
+        fields = SQLite_header(*_HEADER_STRUCT.unpack_from(header_bytes))
         assert fields.page_size in constants.VALID_PAGE_SIZES
         db_size = fields.page_size * fields.size_in_pages
         assert db_size <= file_size
@@ -141,21 +182,36 @@ class SQLite_DB(object):
         _LOGGER.debug(fields)
         return fields
 
-    def build_page_cache(self):
+    def build_page_cache(self, sqlite):
         # The SQLite docs use a numbering convention for pages where the
         # first page (the one that has the header) is page 1, with the next
         # ptrmap page being page 2, etc.
-        page_cache = [None, ]
-        with open(self._path, 'br') as sqlite:
-            for page_idx in range(self._header.size_in_pages):
-                page_offset = page_idx * self._header.page_size
-                sqlite.seek(page_offset, os.SEEK_SET)
-                page_cache.append(sqlite.read(self._header.page_size))
-        self._page_cache = page_cache
-        for page_idx in range(1, len(self._page_cache)):
-            # We want these to be temporary objects, to be replaced with
-            # more specialised objects as parsing progresses
-            self._pages[page_idx] = Page(page_idx, self)
+        #
+        # Rather than reading the whole file into memory, we map it and hand
+        # out zero-copy views of individual pages. The OS page cache takes
+        # care of readahead and pages we never look at are never read.
+        try:
+            self._mmap = mmap.mmap(
+                sqlite.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except (OSError, ValueError) as ex:
+            # Some filesystems (network shares, etc.) can't be mapped. Read
+            # the whole file in one go instead, pages are still views into
+            # that single buffer
+            _LOGGER.warning(
+                "Couldn't map %s into memory (%r), reading it instead",
+                self._path, ex
+            )
+            sqlite.seek(0)
+            self._mmap = sqlite.read()
+        else:
+            # Every page gets parsed, so ask the kernel to start reading
+            # the whole file in asynchronously rather than faulting it in
+            # a page at a time. mmap.madvise() needs Python 3.8
+            if hasattr(self._mmap, 'madvise') and \
+                    hasattr(mmap, 'MADV_WILLNEED'):
+                self._mmap.madvise(mmap.MADV_WILLNEED)
+        self._page_cache = memoryview(self._mmap)
 
     def populate_freelist_pages(self):
         if 0 == self._header.first_freelist_trunk:
@@ -177,35 +233,29 @@ class SQLite_DB(object):
             self._page_types[freelist_trunk_idx] = \
                 constants.FREELIST_TRUNK_PAGE
 
-            trunk_bytes = bytes(self.pages[freelist_trunk_idx])
+            trunk_bytes = self.pages[freelist_trunk_idx].buffer
 
-            next_freelist_trunk_page_idx, num_leaf_pages = struct.unpack(
-                r'>II',
-                trunk_bytes[:8]
-            )
+            next_freelist_trunk_page_idx, num_leaf_pages = \
+                _FREELIST_TRUNK_STRUCT.unpack_from(trunk_bytes, 0)
 
             # Now that we know how long the array of freelist page pointers is,
-            # let's read it again
-            trunk_array = struct.unpack(
-                r'>{count}I'.format(count=2+num_leaf_pages),
-                trunk_bytes[:(4*(2+num_leaf_pages))]
+            # we can read it in one go
+            trunk_array = struct.unpack_from(
+                r'>{count}I'.format(count=num_leaf_pages),
+                trunk_bytes, _FREELIST_TRUNK_STRUCT.size
             )
 
-            # We're skipping the first entries as they are realy the next trunk
-            # index and the leaf count
-            # TODO Fix that
-            leaves_in_trunk = []
-            for page_idx in trunk_array[2:]:
-                # Let's prepare a specialised object for this freelist leaf
-                # page
-                leaf_page = FreelistLeafPage(
-                    page_idx, self, freelist_trunk_idx
-                )
-                leaves_in_trunk.append(leaf_page)
-                self._freelist_leaves.append(page_idx)
-                self._pages[page_idx] = leaf_page
-
-                self._page_types[page_idx] = constants.FREELIST_LEAF_PAGE
+            # Let's prepare specialised objects for this trunk's freelist leaf
+            # pages
+            leaves_in_trunk = [
+                FreelistLeafPage(page_idx, self, freelist_trunk_idx)
+                for page_idx in trunk_array
+            ]
+            self._freelist_leaves.extend(trunk_array)
+            self._pages.update(zip(trunk_array, leaves_in_trunk))
+            self._page_types.update(
+                dict.fromkeys(trunk_array, constants.FREELIST_LEAF_PAGE)
+            )
 
             trunk_page = FreelistTrunkPage(
                 freelist_trunk_idx,
@@ -235,8 +285,9 @@ class SQLite_DB(object):
         # ptrmap
         _LOGGER.info("Parsing overflow pages")
         overflow_count = 0
-        for page_idx in sorted(self._page_types):
-            page_type = self._page_types[page_idx]
+        # Overflow pages are independent of one another, there's no need to
+        # visit them in order
+        for page_idx, page_type in self._page_types.items():
             if page_type not in constants.OVERFLOW_PAGE_TYPES:
                 continue
             overflow_page = OverflowPage(page_idx, self)
@@ -255,59 +306,58 @@ class SQLite_DB(object):
 
         _LOGGER.info("Parsing ptrmap pages")
 
-        ptrmap_page_idx = 2
-        usable_size = self._header.page_size - self._header.reserved_length
-        num_ptrmap_entries_in_page = usable_size // 5
+        num_ptrmap_entries_in_page = self._usable_size // 5
+        ptrmap_array_size = \
+            _PTRMAP_ENTRY_STRUCT.size * num_ptrmap_entries_in_page
         ptrmap_page_indices = []
 
+        # These are looked up once per ptrmap entry
+        ptrmap_page_types = constants.PTRMAP_PAGE_TYPES
+        btree_root_page = constants.BTREE_ROOT_PAGE
+        freelist_page = constants.FREELIST_PAGE
+        freelist_page_types = constants.FREELIST_PAGE_TYPES
+        page_types = self._page_types
+        ptrmap = self._ptrmap
+
         ptrmap_page_idx = 2
-        while ptrmap_page_idx <= self._header.size_in_pages:
-            page_bytes = self._page_cache[ptrmap_page_idx]
+        while ptrmap_page_idx <= self._size_in_pages:
+            page_bytes = self.page_bytes(ptrmap_page_idx)
             ptrmap_page_indices.append(ptrmap_page_idx)
-            self._page_types[ptrmap_page_idx] = constants.PTRMAP_PAGE
-            page_ptrmap_entries = {}
-
-            ptrmap_bytes = page_bytes[:5 * num_ptrmap_entries_in_page]
-            for entry_idx in range(num_ptrmap_entries_in_page):
-                ptr_page_idx = ptrmap_page_idx + entry_idx + 1
-                page_type, page_ptr = struct.unpack(
-                    r'>BI',
-                    ptrmap_bytes[5*entry_idx:5*(entry_idx+1)]
-                )
+            page_types[ptrmap_page_idx] = constants.PTRMAP_PAGE
+            # One past the last page with an entry in this ptrmap page
+            ptr_range_end = ptrmap_page_idx + 1
+
+            # Decode the whole entry array in C rather than one entry at a
+            # time
+            ptrmap_entries = _PTRMAP_ENTRY_STRUCT.iter_unpack(
+                page_bytes[:ptrmap_array_size]
+            )
+            for ptr_page_idx, (page_type, page_ptr) in enumerate(
+                    ptrmap_entries, ptrmap_page_idx + 1):
                 if page_type == 0:
                     break
 
                 ptrmap_entry = SQLite_ptrmap_info(
                     ptr_page_idx, page_type, page_ptr
                 )
-                assert ptrmap_entry.page_type in constants.PTRMAP_PAGE_TYPES
-                if page_type == constants.BTREE_ROOT_PAGE:
-                    assert page_ptr == 0
-                    self._page_types[ptr_page_idx] = page_type
-
-                elif page_type == constants.FREELIST_PAGE:
+                assert page_type in ptrmap_page_types
+                if page_type == freelist_page:
                     # Freelist pages are assumed to be known already
-                    assert self._page_types[ptr_page_idx] in \
-                        constants.FREELIST_PAGE_TYPES
+                    assert page_types[ptr_page_idx] in freelist_page_types
                     assert page_ptr == 0
-
-                elif page_type == constants.FIRST_OFLOW_PAGE:
-                    assert page_ptr != 0
-                    self._page_types[ptr_page_idx] = page_type
-
-                elif page_type == constants.NON_FIRST_OFLOW_PAGE:
-                    assert page_ptr != 0
-                    self._page_types[ptr_page_idx] = page_type
-
-                elif page_type == constants.BTREE_NONROOT_PAGE:
-                    assert page_ptr != 0
-                    self._page_types[ptr_page_idx] = page_type
+                else:
+                    # Only b-tree root pages lack a parent
+                    assert (page_ptr == 0) == (page_type == btree_root_page)
+                    page_types[ptr_page_idx] = page_type
 
                 # _LOGGER.debug("%r", ptrmap_entry)
-                self._ptrmap[ptr_page_idx] = ptrmap_entry
-                page_ptrmap_entries[ptr_page_idx] = ptrmap_entry
+                ptrmap[ptr_page_idx] = ptrmap_entry
+                ptr_range_end = ptr_page_idx + 1
 
-            page = PtrmapPage(ptrmap_page_idx, self, page_ptrmap_entries)
+            page = PtrmapPage(
+                ptrmap_page_idx, self,
+                range(ptrmap_page_idx + 1, ptr_range_end)
+            )
             self._pages[ptrmap_page_idx] = page
             _LOGGER.debug("%r", page)
             ptrmap_page_idx += num_ptrmap_entries_in_page + 1
@@ -317,45 +367,40 @@ class SQLite_DB(object):
             len(ptrmap_page_indices), ptrmap_page_indices
         )
 
+    def _parse_btree_page(self, page_idx):
+        try:
+            # We need to pass in the singleton registry instance
+            page_obj = BTreePage(page_idx, self, self._registry)
+        except ValueError:
+            # This page isn't a valid btree page. This can happen if we
+            # don't have a ptrmap to guide us
+            _LOGGER.warning(
+                "Page %d (%s) is not a btree page",
+                page_idx, self._page_types.get(page_idx)
+            )
+            return None
+
+        page_obj.parse_cells()
+        return page_obj
+
     def populate_btree_pages(self):
         # TODO Should this use table information instead of scanning all pages?
-        page_idx = 1
-        while page_idx <= self._header.size_in_pages:
-            try:
-                if self._page_types[page_idx] in \
-                        constants.NON_BTREE_PAGE_TYPES:
-                    page_idx += 1
-                    continue
-            except KeyError:
-                pass
-
-            try:
-                # We need to pass in the singleton registry instance
-                page_obj = BTreePage(page_idx, self, self._registry)
-            except ValueError:
-                # This page isn't a valid btree page. This can happen if we
-                # don't have a ptrmap to guide us
-                _LOGGER.warning(
-                    "Page %d (%s) is not a btree page",
-                    page_idx,
-                    self._page_types[page_idx]
-                )
-                page_idx += 1
+        non_btree_page_types = constants.NON_BTREE_PAGE_TYPES
+        btree_page_indices = [
+            page_idx for page_idx in range(1, self._size_in_pages + 1)
+            if self._page_types.get(page_idx) not in non_btree_page_types
+        ]
+
+        for page_obj in map(self._parse_btree_page, btree_page_indices):
+            if page_obj is None:
                 continue
-
-            page_obj.parse_cells()
-            self._page_types[page_idx] = page_obj.page_type
-            self._pages[page_idx] = page_obj
-            page_idx += 1
+            self._page_types[page_obj.idx] = page_obj.page_type
+            self._pages[page_obj.idx] = page_obj
 
     def _parse_master_leaf_page(self, page):
-        for cell_idx in page.cells:
-            _, master_record = page.cells[cell_idx]
+        for _, master_record in page.cells:
             assert isinstance(master_record, Record)
-            fields = [
-                master_record.fields[idx].value for idx in master_record.fields
-            ]
-            master_record = SQLite_master_record(*fields)
+            master_record = SQLite_master_record(*master_record.values)
             if 'table' != master_record.type:
                 continue
 
@@ -366,29 +411,22 @@ class SQLite_DB(object):
             # includes a SQL statement that defines the table's columns
             # We need to parse the field names out of that statement
             assert master_record.sql.startswith('CREATE TABLE')
-            columns_re = re.compile(r'^CREATE TABLE (\S+) \((.*)\)$')
-            match = columns_re.match(master_record.sql)
+            match = _CREATE_TABLE_RE.match(master_record.sql)
             if match:
                 assert match.group(1) == master_record.name
                 column_list = match.group(2)
-                csl_between_parens_re = re.compile(r'\([^)]+\)')
-                expunged = csl_between_parens_re.sub('', column_list)
-
-                cols = [
-                    statement.strip() for statement in expunged.split(',')
-                ]
-                cols = [
-                    statement for statement in cols if not (
-                        statement.startswith('PRIMARY') or
-                        statement.startswith('UNIQUE')
-                    )
-                ]
-                columns = [col.split()[0] for col in cols]
-                signature = []
+                expunged = _BETWEEN_PARENS_RE.sub('', column_list)
 
-                # Some column definitions lack a type
-                for col_def in cols:
+                columns = []
+                signature = []
+                for col_def in expunged.split(','):
                     def_tokens = col_def.split()
+                    # Table constraints aren't columns
+                    if def_tokens[0].startswith(('PRIMARY', 'UNIQUE')):
+                        continue
+                    columns.append(def_tokens[0])
+
+                    # Some column definitions lack a type
                     try:
                         col_type = def_tokens[1]
                     except IndexError:
@@ -402,7 +440,9 @@ class SQLite_DB(object):
                     try:
                         signature.append(type_specs[col_type])
                     except KeyError:
-                        _LOGGER.warning("No native type for \"%s\"", col_def)
+                        _LOGGER.warning(
+                            "No native type for \"%s\"", col_def.strip()
+                        )
                         signature.append(object)
                 _LOGGER.info(
                     "Signature for table \"%s\": %r",
@@ -440,7 +480,6 @@ class SQLite_DB(object):
             try:
                 table_obj = Table(table_name, self, rootpage, signatures)
             except Exception as ex:  # pylint:disable=W0703
-                # pdb.set_trace()
                 _LOGGER.warning(
                     "Caught %r while instantiating table object for \"%s\"",
                     ex, table_name
@@ -450,7 +489,8 @@ class SQLite_DB(object):
 
     def reparent_orphaned_table_leaf_pages(self):
         reparented_pages = []
-        for page in self.pages.values():
+        for page_idx in sorted(self.pages):
+            page = self.pages[page_idx]
             if not isinstance(page, BTreePage):
                 continue
             if page.page_type != "Table Leaf":
@@ -470,14 +510,16 @@ class SQLite_DB(object):
                     if not page.cells:
                         continue
 
+                    # All records within a given page are for the same
+                    # table
                     first_record = page.cells[0][1]
-                    matches = []
-                    for table_name in signatures:
-                        # All records within a given page are for the same
-                        # table
+                    matches = [
+                        self.tables[table_name]
+                        for table_name in signatures
                         if self.tables[table_name].check_signature(
-                                first_record):
-                            matches.append(self.tables[table_name])
+                            first_record
+                        )
+                    ]
                     if not matches:
                         _LOGGER.error(
                             "Couldn't find a matching table for %r",
@@ -498,31 +540,40 @@ class SQLite_DB(object):
                     page, root_table.name
                 )
                 root_table.add_leaf(page)
-                self.map_table_page(page.idx, root_table)
-                reparented_pages.append(page)
+                reparented_pages.append((page, root_table))
 
+        # Only leaf pages get reparented, so none of the above lookups depend
+        # on mappings made within the loop
+        self._page_tables.update(
+            (page.idx, root_table) for page, root_table in reparented_pages
+        )
         if reparented_pages:
             _LOGGER.info(
                 "Reparented %d pages: %r",
-                len(reparented_pages), [p.idx for p in reparented_pages]
+                len(reparented_pages), [p.idx for p, _ in reparented_pages]
             )
 
     def grep(self, needle):
         match_found = False
-        page_idx = 1
+        page_size = self._page_size
         needle_re = re.compile(needle.encode('utf-8'))
-        while (page_idx <= self.header.size_in_pages):
+        # Scan the whole mapped file in one go. This is a lot cheaper than
+        # scanning each page individually and also finds matches that span a
+        # page boundary.
+        db_bytes = self._page_cache[:self._size_in_pages * page_size]
+        matches_by_page = itertools.groupby(
+            (match.start() for match in needle_re.finditer(db_bytes)),
+            key=lambda needle_offset: needle_offset // page_size + 1
+        )
+        for page_idx, needle_offsets in matches_by_page:
+            match_found = True
             page = self.pages[page_idx]
-            page_offsets = []
-            for match in needle_re.finditer(bytes(page)):
-                needle_offset = match.start()
-                page_offsets.append(needle_offset)
-            if page_offsets:
-                _LOGGER.info(
-                    "Found search term in page %r @ offset(s) %s",
-                    page, ', '.join(str(offset) for offset in page_offsets)
+            _LOGGER.info(
+                "Found search term in page %r @ offset(s) %s",
+                page, ', '.join(
+                    str(offset % page_size) for offset in needle_offsets
                 )
-            page_idx += 1
+            )
         if not match_found:
             _LOGGER.warning(
                 "Search term not found",
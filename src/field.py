@@ -22,7 +22,33 @@
 
 import struct
 
-from .utils import decode_twos_complement
+
+# Record fields are always big-endian
+_INT8_STRUCT = struct.Struct(r'>b')
+_INT16_STRUCT = struct.Struct(r'>h')
+_INT32_STRUCT = struct.Struct(r'>i')
+_INT64_STRUCT = struct.Struct(r'>q')
+_DOUBLE_STRUCT = struct.Struct(r'>d')
+
+
+def _decode_signed(field_bytes):
+    # struct can't express the 24 and 48-bit widths
+    return int.from_bytes(field_bytes, byteorder='big', signed=True)
+
+
+# Serial type: (content length, decoder)
+_FIXED_WIDTH_TYPES = {
+    0: (0, lambda field_bytes: None),
+    1: (1, lambda field_bytes: _INT8_STRUCT.unpack(field_bytes)[0]),
+    2: (2, lambda field_bytes: _INT16_STRUCT.unpack(field_bytes)[0]),
+    3: (3, _decode_signed),
+    4: (4, lambda field_bytes: _INT32_STRUCT.unpack(field_bytes)[0]),
+    5: (6, _decode_signed),
+    6: (8, lambda field_bytes: _INT64_STRUCT.unpack(field_bytes)[0]),
+    7: (8, lambda field_bytes: _DOUBLE_STRUCT.unpack(field_bytes)[0]),
+    8: (0, lambda field_bytes: 0),
+    9: (0, lambda field_bytes: 1),
+}
 
 
 class MalformedField(Exception):
@@ -30,67 +56,65 @@ class MalformedField(Exception):
 
 
 class Field(object):
+    # There's one of these for every column of every record, don't give them
+    # a __dict__
+    __slots__ = ('_index', '_type', '_bytes', '_value')
+
     def __init__(self, idx, serial_type, serial_bytes):
+        self._init(idx, serial_type, serial_bytes)
+        if not self._parse():
+            raise MalformedField
+
+    def _init(self, idx, serial_type, serial_bytes):
+        # Shared with try_from(), which doesn't go through __init__()
         self._index = idx
         self._type = serial_type
         self._bytes = serial_bytes
         self._value = None
-        self._parse()
 
-    def _check_length(self, expected_length):
-        if len(self) != expected_length:
-            raise MalformedField
+    @classmethod
+    def try_from(cls, idx, serial_type, serial_bytes):
+        # Same as the constructor, but returns None rather than raising
+        # MalformedField
+        field_obj = cls.__new__(cls)
+        field_obj._init(idx, serial_type, serial_bytes)
+        if not field_obj._parse():
+            return None
+        return field_obj
 
-    # TODO Raise a specific exception when bad bytes are encountered for the
-    # fields and then use this to weed out bad freeblock records
     def _parse(self):
-        if self._type == 0:
-            self._value = None
-        # Integer types
-        elif self._type == 1:
-            self._check_length(1)
-            self._value = decode_twos_complement(bytes(self)[0:1], 8)
-        elif self._type == 2:
-            self._check_length(2)
-            self._value = decode_twos_complement(bytes(self)[0:2], 16)
-        elif self._type == 3:
-            self._check_length(3)
-            self._value = decode_twos_complement(bytes(self)[0:3], 24)
-        elif self._type == 4:
-            self._check_length(4)
-            self._value = decode_twos_complement(bytes(self)[0:4], 32)
-        elif self._type == 5:
-            self._check_length(6)
-            self._value = decode_twos_complement(bytes(self)[0:6], 48)
-        elif self._type == 6:
-            self._check_length(8)
-            self._value = decode_twos_complement(bytes(self)[0:8], 64)
-
-        elif self._type == 7:
-            self._value = struct.unpack(r'>d', bytes(self)[0:8])[0]
-        elif self._type == 8:
-            self._value = 0
-        elif self._type == 9:
-            self._value = 1
-        elif self._type >= 13 and (1 == self._type % 2):
+        # Returns False when the bytes don't make sense for the serial type
+        field_type = self._type
+        field_bytes = self._bytes
+
+        fixed_width = _FIXED_WIDTH_TYPES.get(field_type)
+        if fixed_width is not None:
+            expected_length, decoder = fixed_width
+            if len(field_bytes) != expected_length:
+                return False
+            self._value = decoder(field_bytes)
+
+        elif field_type >= 13 and (1 == field_type % 2):
             try:
-                self._value = bytes(self).decode('utf-8')
-            except UnicodeDecodeError as ex:
-                raise MalformedField from ex
+                self._value = field_bytes.decode('utf-8')
+            except UnicodeDecodeError:
+                return False
+
+        elif field_type >= 12 and (0 == field_type % 2):
+            self._value = field_bytes
 
-        elif self._type >= 12 and (0 == self._type % 2):
-            self._value = bytes(self)
+        return True
 
     def __bytes__(self):
         return self._bytes
 
     def __repr__(self):
         return "<Field {}: {} ({} bytes)>".format(
-            self._index, self._value, len(bytes(self))
+            self._index, self._value, len(self._bytes)
         )
 
     def __len__(self):
-        return len(bytes(self))
+        return len(self._bytes)
 
     @property
     def index(self):
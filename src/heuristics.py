@@ -20,8 +20,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import array
 import os
-from pkg_resources import resource_stream
+import pkgutil
 import re
 import yaml
 
@@ -29,30 +30,76 @@ from . import _LOGGER
 from . import PROJECT_NAME, USER_YAML_PATH, BUILTIN_YAML
 
 
+_REGEX_METACHARACTERS_RE = re.compile(rb'[\\.^$*+?{}\[\]|()]')
+# PyYAML only has the libyaml-backed loader when it was built against libyaml
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
 class Heuristic(object):
     def __init__(self, magic, offset, grouping, table, name_regex=None):
         self._offset = offset
         self._table_name = table
         self._grouping = grouping
-        self._magic_re = re.compile(magic)
+        self._magic = magic
+        # Only heuristics that actually get used need a compiled pattern
+        self._compiled_magic_re = None
+        # A lot of magic values are plain byte strings rather than patterns,
+        # there's no need to involve the regex engine for those
+        self._literal_magic = None
+        if magic and not _REGEX_METACHARACTERS_RE.search(magic):
+            self._literal_magic = magic
+
+        # Freeblocks shorter than this can't contain a match that leaves room
+        # for the bytes before the magic
+        self._min_freeblock_length = offset
+        if self._literal_magic is not None:
+            self._min_freeblock_length += len(self._literal_magic)
 
         self._table_name_regex = None
         if name_regex is not None:
             self._table_name_regex = re.compile(name_regex)
 
+    @property
+    def _magic_re(self):
+        if self._compiled_magic_re is None:
+            # Magic patterns match binary data, where a newline is just
+            # another byte value
+            self._compiled_magic_re = re.compile(self._magic, re.DOTALL)
+        return self._compiled_magic_re
+
     def __repr__(self):
         return "<Record heuristic for table \"{0}\"({1})>".format(
             self._table_name, self._grouping
         )
 
+    def _magic_offsets_reversed(self, freeblock_bytes):
+        # We need to unwind the full set of matches so we can traverse it in
+        # reverse. Only the match offsets are needed, there's no point in
+        # keeping every match object alive
+        offsets = array.array('l')
+        literal_magic = self._literal_magic
+        if literal_magic is not None:
+            # Searching forwards keeps the same non-overlapping semantics as
+            # finditer(), so literal and regex magic yield the same candidates
+            magic_length = len(literal_magic)
+            magic_offset = freeblock_bytes.find(literal_magic)
+            while magic_offset >= 0:
+                offsets.append(magic_offset)
+                magic_offset = freeblock_bytes.find(
+                    literal_magic, magic_offset + magic_length
+                )
+        else:
+            offsets.extend(
+                match.start()
+                for match in self._magic_re.finditer(freeblock_bytes)
+            )
+        yield from reversed(offsets)
+
     def __call__(self, freeblock_bytes):
-        # We need to unwind the full set of matches so we can traverse it
-        # in reverse
-        all_matches = [
-            match for match in self._magic_re.finditer(freeblock_bytes)
-        ]
-        for magic_match in all_matches[::-1]:
-            header_start = magic_match.start() - self._offset
+        if len(freeblock_bytes) < self._min_freeblock_length:
+            return
+        for magic_offset in self._magic_offsets_reversed(freeblock_bytes):
+            header_start = magic_offset - self._offset
             if header_start < 0:
                 _LOGGER.debug("Header start outside of freeblock!")
                 break
@@ -68,7 +115,15 @@ class Heuristic(object):
 class HeuristicsRegistry(dict):
 
     def __init__(self):
-        super().__init__(self)
+        super().__init__()
+        # Resolved heuristics, keyed by (table name, grouping)
+        self._resolved = {}
+        # Heuristics that match table names against a regex rather than the
+        # name they're keyed on, by grouping
+        self._name_regex_heuristics = {}
+        # Sorted views of the registry, built on demand
+        self._groupings = None
+        self._all_tables = None
 
     @staticmethod
     def check_heuristic(magic, offset):
@@ -80,7 +135,7 @@ class HeuristicsRegistry(dict):
         if isinstance(yaml_string, bytes):
             yaml_string = yaml_string.decode('utf-8')
 
-        raw_yaml = yaml.load(yaml_string, Loader=yaml.CLoader)
+        raw_yaml = yaml.load(yaml_string, Loader=_YAML_LOADER)
         # TODO Find a more descriptive term than "table grouping"
         for table_grouping, tables in raw_yaml.items():
             _LOGGER.debug(
@@ -88,24 +143,33 @@ class HeuristicsRegistry(dict):
                 table_grouping
             )
             grouping_tables = {}
+            name_regex_heuristics = []
             for table_name, table_props in tables.items():
                 self.check_heuristic(
                     table_props['magic'], table_props['offset']
                 )
-                grouping_tables[table_name] = Heuristic(
+                heuristic = Heuristic(
                     table_props['magic'], table_props['offset'],
                     table_grouping, table_name,
                     name_regex=table_props.get('name_regex')
                 )
+                grouping_tables[table_name] = heuristic
+                if table_props.get('name_regex') is not None:
+                    name_regex_heuristics.append(heuristic)
                 _LOGGER.debug("Loaded heuristics for \"%s\"", table_name)
             self[table_grouping] = grouping_tables
+            self._name_regex_heuristics[table_grouping] = name_regex_heuristics
+        self._resolved.clear()
+        self._groupings = None
+        self._all_tables = None
 
     def load_heuristics(self):
-        with resource_stream(PROJECT_NAME, BUILTIN_YAML) as builtin:
-            try:
-                self._load_from_yaml(builtin.read())
-            except KeyError as ex:
-                raise SystemError("Malformed builtin magic file") from ex
+        # pkgutil is much cheaper to import than pkg_resources
+        builtin_yaml = pkgutil.get_data(PROJECT_NAME, BUILTIN_YAML)
+        try:
+            self._load_from_yaml(builtin_yaml)
+        except KeyError as ex:
+            raise SystemError("Malformed builtin magic file") from ex
 
         if not os.path.exists(USER_YAML_PATH):
             return
@@ -117,34 +181,42 @@ class HeuristicsRegistry(dict):
 
     @property
     def groupings(self):
-        for db_name in sorted(self.keys()):
-            yield db_name
+        if self._groupings is None:
+            self._groupings = tuple(sorted(self.keys()))
+        return self._groupings
 
     @property
     def all_tables(self):
-        for db in self.groupings:
-            for table in self[db].keys():
-                yield (db, table)
+        if self._all_tables is None:
+            self._all_tables = tuple(
+                (db, table) for db in self.groupings for table in self[db]
+            )
+        return self._all_tables
 
     def _get_heuristic_in_grouping(self, db_table, grouping):
-        heuristic_name = None
-        if grouping in self:
-            for heuristic_name in self[grouping]:
-                if self[grouping][heuristic_name].match(db_table):
-                    break
-            else:
-                # We haven't found a match within the grouping... what
-                # shall we do?
-                raise ValueError("No heuristic found")
-
-            return self[grouping][heuristic_name]
-
-        else:
+        if grouping not in self:
             raise ValueError(
                 "No heuristic defined for table \"%s\" in grouping \"%s\"" %
                 (db_table.name, grouping)
             )
 
+        # Most heuristics apply to the table they're named after
+        try:
+            heuristic = self[grouping][db_table.name]
+        except KeyError:
+            pass
+        else:
+            if heuristic.match(db_table):
+                return heuristic
+
+        # Only those with a name regex can match another table
+        for heuristic in self._name_regex_heuristics[grouping]:
+            if heuristic.match(db_table):
+                return heuristic
+
+        # We haven't found a match within the grouping... what shall we do?
+        raise ValueError("No heuristic found")
+
     def _get_heuristic_in_all_groupings(self, db_table):
         grouping = None
         heuristic_name = None
@@ -160,7 +232,17 @@ class HeuristicsRegistry(dict):
         return self[grouping][heuristic_name]
 
     def get_heuristic(self, db_table, grouping):
+        # This gets called for every page in a table, but the outcome only
+        # depends on the table's name
+        resolved_key = (db_table.name, grouping)
+        try:
+            return self._resolved[resolved_key]
+        except KeyError:
+            pass
+
         if grouping is not None:
-            return self._get_heuristic_in_grouping(db_table, grouping)
+            heuristic = self._get_heuristic_in_grouping(db_table, grouping)
         else:
-            return self._get_heuristic_in_all_groupings(db_table)
+            heuristic = self._get_heuristic_in_all_groupings(db_table)
+        self._resolved[resolved_key] = heuristic
+        return heuristic
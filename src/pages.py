@@ -20,19 +20,34 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import array
 import struct
+import sys
 
 from . import _LOGGER
-from .record import (Record, MalformedRecord)
+from .record import Record
 from .tuples import SQLite_btree_page_header
-from .utils import (Varint, IndexDict)
+from .utils import decode_varint
+
+
+_LEAF_HEADER_STRUCT = struct.Struct(r'>BHHHB')
+_INTERIOR_HEADER_STRUCT = struct.Struct(r'>BHHHBI')
+_PAGE_PTR_STRUCT = struct.Struct(r'>I')
+_FREEBLOCK_HEADER_STRUCT = struct.Struct(r'>HH')
 
 
 class Page(object):
+    # There's one of these per page in the database, don't give each of them
+    # a __dict__
+    __slots__ = ('_page_idx', '_db', '_buffer', '_bytes')
+
     def __init__(self, page_idx, db):
         self._page_idx = page_idx
         self._db = db
-        self._bytes = db.page_bytes(self.idx)
+        # This is a view into the database file's mapping. We only make a
+        # copy of the page's contents when someone asks for bytes(page)
+        self._buffer = db.page_bytes(self.idx)
+        self._bytes = None
 
     @property
     def idx(self):
@@ -40,18 +55,27 @@ class Page(object):
 
     @property
     def usable_size(self):
-        return self._db.header.page_size - self._db.header.reserved_length
+        return self._db.usable_size
+
+    @property
+    def buffer(self):
+        # Zero-copy view of the page, suitable for struct.unpack_from, re and
+        # slicing
+        return self._buffer
 
     def __bytes__(self):
+        if self._bytes is None:
+            self._bytes = bytes(self._buffer)
         return self._bytes
 
     @property
     def parent(self):
-        try:
-            parent_idx = self._db.ptrmap[self.idx].page_ptr
-        except KeyError:
+        # Only auto-vacuum databases have pointer maps, a miss is the norm
+        ptrmap_entry = self._db.ptrmap.get(self.idx)
+        if ptrmap_entry is None:
             return None
 
+        parent_idx = ptrmap_entry.page_ptr
         if 0 == parent_idx:
             return None
         else:
@@ -62,6 +86,8 @@ class Page(object):
 
 
 class FreelistTrunkPage(Page):
+    __slots__ = ('_leaves',)
+
     # XXX Maybe it would make sense to expect a Page instance as constructor
     # argument?
     def __init__(self, page_idx, db, leaves):
@@ -75,6 +101,8 @@ class FreelistTrunkPage(Page):
 
 
 class FreelistLeafPage(Page):
+    __slots__ = ('_trunk',)
+
     # XXX Maybe it would make sense to expect a Page instance as constructor
     # argument?
     def __init__(self, page_idx, db, trunk_idx):
@@ -88,23 +116,32 @@ class FreelistLeafPage(Page):
 
 
 class PtrmapPage(Page):
+    __slots__ = ('_ptr_range',)
+
     # XXX Maybe it would make sense to expect a Page instance as constructor
     # argument?
-    def __init__(self, page_idx, db, ptr_array):
+    def __init__(self, page_idx, db, ptr_range):
         super().__init__(page_idx, db)
-        self._pointers = ptr_array
+        # The indices of the pages this ptrmap page has entries for. The
+        # entries themselves live in the DB's ptrmap
+        self._ptr_range = ptr_range
 
     @property
     def pointers(self):
-        return self._pointers
+        return {
+            ptr_page_idx: self._db.ptrmap[ptr_page_idx]
+            for ptr_page_idx in self._ptr_range
+        }
 
     def __repr__(self):
         return "<SQLite Ptrmap Page {0}. {1} pointers>".format(
-            self.idx, len(self.pointers)
+            self.idx, len(self._ptr_range)
         )
 
 
 class OverflowPage(Page):
+    __slots__ = ()
+
     # XXX Maybe it would make sense to expect a Page instance as constructor
     # argument?
     def __init__(self, page_idx, db):
@@ -129,36 +166,53 @@ class BTreePage(Page):
         0x0A:   "Index Leaf",
         0x0D:   "Table Leaf",
     }
+    __slots__ = (
+        '_heuristics', '_header_offset', '_header_size', '_btree_header',
+        '_cell_ptr_array', '_freeblocks', '_cells', '_recovered_records',
+        '_overflow_threshold', '_min_local_payload', '_usable_size_minus_4',
+    )
 
     def __init__(self, page_idx, db, heuristics):
         # XXX We don't know a page's type until we've had a look at the header.
         # Or do we?
         super().__init__(page_idx, db)
         self._heuristics = heuristics
-        self._header_size = 8
-        page_header_bytes = self._get_btree_page_header()
-        self._btree_header = SQLite_btree_page_header(
-            # Set the right-most page index to None in the 1st pass
-            *struct.unpack(r'>BHHHB', page_header_bytes), None
-        )
+        # Page 1 starts with the 100-byte database header
+        self._header_offset = 100 if self.idx == 1 else 0
+        page_type = self._buffer[self._header_offset]
+        # Interior pages have a twelve-byte header that includes the
+        # right-most page index
+        if page_type in (0x02, 0x05):
+            self._header_size = _INTERIOR_HEADER_STRUCT.size
+            self._btree_header = SQLite_btree_page_header(
+                *_INTERIOR_HEADER_STRUCT.unpack_from(
+                    self._buffer, self._header_offset
+                )
+            )
+        else:
+            self._header_size = _LEAF_HEADER_STRUCT.size
+            self._btree_header = SQLite_btree_page_header(
+                *_LEAF_HEADER_STRUCT.unpack_from(
+                    self._buffer, self._header_offset
+                ),
+                None
+            )
         self._cell_ptr_array = []
-        self._freeblocks = IndexDict()
-        self._cells = IndexDict()
-        self._recovered_records = set()
+        # Many pages have no freeblocks and will never have records recovered
+        # from them, these are only turned into lists once there's something
+        # to put in them
+        self._freeblocks = ()
+        self._cells = ()
+        self._recovered_records = ()
         self._overflow_threshold = self.usable_size - 35
+        # M and U-4 from the overflow computation only depend on the usable
+        # size, see parse_table_leaf_cells()
+        self._min_local_payload = int(((self.usable_size - 12) * 32/255)-23)
+        self._usable_size_minus_4 = self.usable_size - 4
 
         if self._btree_header.page_type not in BTreePage.btree_page_types:
-            # pdb.set_trace()
             raise ValueError
 
-        # We have a twelve-byte header, need to read it again
-        if self._btree_header.page_type in (0x02, 0x05):
-            self._header_size = 12
-            page_header_bytes = self._get_btree_page_header()
-            self._btree_header = SQLite_btree_page_header(*struct.unpack(
-                r'>BHHHBI', page_header_bytes
-            ))
-
         # Page 1 (and page 2, but that's the 1st ptrmap page) does not have a
         # ptrmap entry.
         # The first ptrmap page will contain back pointer information for pages
@@ -170,13 +224,16 @@ class BTreePage(Page):
                 )
 
         if self._btree_header.num_cells > 0:
-            cell_ptr_bytes = self._get_btree_ptr_array(
-                self._btree_header.num_cells
-            )
-            self._cell_ptr_array = struct.unpack(
-                r'>{count}H'.format(count=self._btree_header.num_cells),
-                cell_ptr_bytes
-            )
+            # The cell pointer array is big-endian 16-bit offsets. Keeping it
+            # as an array saves us an int object per cell
+            ptr_array_offset = self._header_offset + self._header_size
+            self._cell_ptr_array = array.array('H')
+            self._cell_ptr_array.frombytes(self._buffer[
+                ptr_array_offset:
+                ptr_array_offset + 2 * self._btree_header.num_cells
+            ])
+            if sys.byteorder == 'little':
+                self._cell_ptr_array.byteswap()
             smallest_cell_offset = min(self._cell_ptr_array)
             if self._btree_header.cell_content_offset != smallest_cell_offset:
                 _LOGGER.warning(
@@ -198,7 +255,6 @@ class BTreePage(Page):
         try:
             return self.btree_page_types[self._btree_header.page_type]
         except KeyError:
-            # pdb.set_trace()
             _LOGGER.warning(
                 "Unknown B-Tree page type: %d", self._btree_header.page_type
             )
@@ -222,18 +278,6 @@ class BTreePage(Page):
     def table(self):
         return self._db.get_page_table(self.idx)
 
-    def _get_btree_page_header(self):
-        header_offset = 0
-        if self.idx == 1:
-            header_offset += 100
-        return bytes(self)[header_offset:self._header_size + header_offset]
-
-    def _get_btree_ptr_array(self, num_cells):
-        array_offset = self._header_size
-        if self.idx == 1:
-            array_offset += 100
-        return bytes(self)[array_offset:2 * num_cells + array_offset]
-
     def parse_cells(self):
         if self.btree_header.page_type == 0x05:
             self.parse_table_interior_cells()
@@ -246,27 +290,33 @@ class BTreePage(Page):
             assert False
 
         _LOGGER.debug("Parsing cells in table interior cell %d", self.idx)
-        for cell_idx, offset in enumerate(self._cell_ptr_array):
-            _LOGGER.debug("Parsing cell %d @ offset %d", cell_idx, offset)
-            left_ptr_bytes = bytes(self)[offset:offset + 4]
-            left_ptr, = struct.unpack(r'>I', left_ptr_bytes)
+        cells = self._cells = []
+        for offset in self._cell_ptr_array:
+            left_ptr, = _PAGE_PTR_STRUCT.unpack_from(self._buffer, offset)
 
             offset += 4
-            integer_key = Varint(bytes(self)[offset:offset+9])
-            self._cells[cell_idx] = (left_ptr, int(integer_key))
+            integer_key, _ = decode_varint(self._buffer, offset)
+            cells.append((left_ptr, integer_key))
 
     def parse_table_leaf_cells(self):
         if self.btree_header.page_type != 0x0d:
             assert False
 
         _LOGGER.debug("Parsing cells in table leaf cell %d", self.idx)
-        for cell_idx, cell_offset in enumerate(self._cell_ptr_array):
-            _LOGGER.debug("Parsing cell %d @ offset %d", cell_idx, cell_offset)
-
+        buffer = self._buffer
+        buffer_len = len(buffer)
+        overflow_threshold = self._overflow_threshold
+        m = self._min_local_payload
+        usable_size_minus_4 = self._usable_size_minus_4
+        db = self._db
+        # No payload can be larger than the database file itself
+        max_payload_size = db.size_in_pages * db.usable_size
+        cells = self._cells = []
+
+        for cell_offset in self._cell_ptr_array:
             # This is the total size of the payload, which may include overflow
             offset = cell_offset
-            payload_length_varint = Varint(bytes(self)[offset:offset+9])
-            total_payload_size = int(payload_length_varint)
+            total_payload_size, varint_length = decode_varint(buffer, offset)
 
             overflow = False
             # Let X be U-35. If the payload size P is less than or equal to X
@@ -276,10 +326,9 @@ class BTreePage(Page):
             # b-tree leaf page is K if K is less or equal to X or M otherwise.
             # The number of bytes stored on the leaf page is never less than M.
             cell_payload_size = 0
-            if total_payload_size > self._overflow_threshold:
-                m = int(((self.usable_size - 12) * 32/255)-23)
-                k = m + ((total_payload_size - m) % (self.usable_size - 4))
-                if k <= self._overflow_threshold:
+            if total_payload_size > overflow_threshold:
+                k = m + ((total_payload_size - m) % usable_size_minus_4)
+                if k <= overflow_threshold:
                     cell_payload_size = k
                 else:
                     cell_payload_size = m
@@ -287,60 +336,67 @@ class BTreePage(Page):
             else:
                 cell_payload_size = total_payload_size
 
-            offset += len(payload_length_varint)
+            offset += varint_length
 
-            integer_key = Varint(bytes(self)[offset:offset+9])
-            offset += len(integer_key)
+            integer_key, varint_length = decode_varint(buffer, offset)
+            offset += varint_length
 
-            overflow_bytes = bytes()
             if overflow:
-                first_oflow_page_bytes = bytes(self)[
-                    offset + cell_payload_size:offset + cell_payload_size + 4
-                ]
-                if not first_oflow_page_bytes:
+                first_oflow_ptr_offset = offset + cell_payload_size
+                if first_oflow_ptr_offset >= buffer_len:
                     continue
+                if total_payload_size > max_payload_size:
+                    # Don't try to allocate a buffer for a corrupt payload
+                    # size
+                    _LOGGER.warning(
+                        "Record %d in page %d claims a %d-byte payload, "
+                        "skipping it",
+                        integer_key, self.idx, total_payload_size
+                    )
+                    continue
+
+                # We know the full payload size up front, fill in a single
+                # buffer rather than growing one page at a time
+                payload = bytearray(total_payload_size)
+                payload[:cell_payload_size] = \
+                    buffer[offset:first_oflow_ptr_offset]
+                payload_len = cell_payload_size
 
-                first_oflow_idx, = struct.unpack(
-                    r'>I', first_oflow_page_bytes
+                next_oflow_idx, = _PAGE_PTR_STRUCT.unpack_from(
+                    buffer, first_oflow_ptr_offset
                 )
-                next_oflow_idx = first_oflow_idx
                 while next_oflow_idx != 0:
-                    oflow_page_bytes = self._db.page_bytes(next_oflow_idx)
+                    oflow_page_bytes = db.page_bytes(next_oflow_idx)
 
                     len_overflow = min(
                         len(oflow_page_bytes) - 4,
-                        (
-                            total_payload_size - cell_payload_size -
-                            len(overflow_bytes)
-                        )
+                        total_payload_size - payload_len
                     )
-                    overflow_bytes += oflow_page_bytes[4:4 + len_overflow]
+                    payload[payload_len:payload_len + len_overflow] = \
+                        oflow_page_bytes[4:4 + len_overflow]
+                    payload_len += len_overflow
 
-                    first_four_bytes = oflow_page_bytes[:4]
-                    next_oflow_idx, = struct.unpack(
-                        r'>I', first_four_bytes
+                    next_oflow_idx, = _PAGE_PTR_STRUCT.unpack_from(
+                        oflow_page_bytes, 0
                     )
 
-            try:
-                cell_data = bytes(self)[offset:offset + cell_payload_size]
-                if overflow_bytes:
-                    cell_data += overflow_bytes
-
                 # All payload bytes should be accounted for
+                assert payload_len == total_payload_size
+                cell_data = bytes(payload)
+            else:
+                cell_data = bytes(buffer[offset:offset + cell_payload_size])
                 assert len(cell_data) == total_payload_size
 
+            try:
                 record_obj = Record(cell_data)
-                _LOGGER.debug("Created record: %r", record_obj)
-
             except TypeError as ex:
                 _LOGGER.warning(
                     "Caught %r while instantiating record %d",
-                    ex, int(integer_key)
+                    ex, integer_key
                 )
-                # pdb.set_trace()
                 raise
 
-            self._cells[cell_idx] = (int(integer_key), record_obj)
+            cells.append((integer_key, record_obj))
 
     def parse_freeblocks(self):
         # The first 2 bytes of a freeblock are a big-endian integer which is
@@ -357,22 +413,23 @@ class BTreePage(Page):
         # TODO But what about deleted records that exceeded the overflow
         # threshold in the past?
         block_offset = self.btree_header.first_freeblock_offset
+        if block_offset == 0:
+            return
+
+        buffer = self._buffer
+        freeblocks = self._freeblocks = []
         while block_offset != 0:
-            freeblock_header = bytes(self)[block_offset:block_offset + 4]
             # Freeblock_size includes the 4-byte header
-            next_freeblock_offset, freeblock_size = struct.unpack(
-                r'>HH',
-                freeblock_header
+            next_freeblock_offset, freeblock_size = \
+                _FREEBLOCK_HEADER_STRUCT.unpack_from(buffer, block_offset)
+            freeblock_bytes = bytes(
+                buffer[block_offset + 4:block_offset + freeblock_size]
             )
-            freeblock_bytes = bytes(self)[
-                block_offset + 4:block_offset + freeblock_size - 4
-            ]
-            self._freeblocks[block_offset] = freeblock_bytes
+            freeblocks.append((block_offset, freeblock_bytes))
             block_offset = next_freeblock_offset
 
     def print_cells(self):
-        for cell_idx in self.cells.keys():
-            rowid, record = self.cells[cell_idx]
+        for cell_idx, (rowid, record) in enumerate(self.cells):
             _LOGGER.info(
                 "Cell %d, rowid: %d, record: %r",
                 cell_idx, rowid, record
@@ -403,8 +460,9 @@ class BTreePage(Page):
         )
 
         _LOGGER.info("Attempting to recover records from freeblocks")
-        for freeblock_idx, freeblock_offset in enumerate(self._freeblocks):
-            freeblock_bytes = self._freeblocks[freeblock_offset]
+        self._recovered_records = []
+        for freeblock_idx, (freeblock_offset, freeblock_bytes) in \
+                enumerate(self._freeblocks):
             if 0 == len(freeblock_bytes):
                 continue
             _LOGGER.debug(
@@ -421,32 +479,23 @@ class BTreePage(Page):
             # TODO Maybe we need to guess the record header lengths rather than
             # try and read them from the freeblocks
             for header_start in table_heuristic(freeblock_bytes):
-                _LOGGER.debug(
-                    (
-                        "Trying potential record header start at "
-                        "freeblock offset %d/%d"
-                    ),
-                    header_start, len(freeblock_bytes)
-                )
-                _LOGGER.debug("%r", freeblock_bytes)
-                try:
-                    # We don't know how to handle overflow in deleted records,
-                    # so we'll have to truncate the bytes object used to
-                    # instantiate the Record object
-                    record_bytes = freeblock_bytes[
-                        header_start:header_start+self._overflow_threshold
-                    ]
-                    record_obj = Record(record_bytes)
-                except MalformedRecord:
+                # We don't know how to handle overflow in deleted records,
+                # so we'll have to truncate the bytes object used to
+                # instantiate the Record object
+                record_bytes = freeblock_bytes[
+                    header_start:header_start+self._overflow_threshold
+                ]
+                record_obj = Record.try_parse(record_bytes)
+                if record_obj is None:
                     # This isn't a well-formed record, let's move to the next
                     # candidate
                     continue
 
                 field_lengths = sum(
-                    len(field_obj) for field_obj in record_obj.fields.values()
+                    len(field_obj) for field_obj in record_obj.fields
                 )
                 record_obj.truncate(field_lengths + len(record_obj.header))
-                self._recovered_records.add(record_obj)
+                self._recovered_records.append(record_obj)
 
                 recovered_bytes += len(bytes(record_obj))
                 recovered_in_freeblock += 1
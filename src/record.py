@@ -20,9 +20,19 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import operator
+
 from . import _LOGGER
-from .field import (Field, MalformedField)
-from .utils import (Varint, IndexDict)
+from .field import Field
+from .utils import decode_varint
+
+
+_FIELD_VALUE = operator.attrgetter('value')
+# Record header bytes: ((serial type, field start, field end), ...)
+_HEADER_LAYOUTS = {}
+# Tables with variable-length columns have a lot of distinct headers, don't
+# let the cache grow without bounds
+_MAX_HEADER_LAYOUTS = 65536
 
 
 class MalformedRecord(Exception):
@@ -45,10 +55,15 @@ class Record(object):
     }
 
     def __init__(self, record_bytes):
+        self._init(record_bytes)
+        self._parse()
+
+    def _init(self, record_bytes):
+        # Shared with try_parse(), which doesn't go through __init__()
         self._bytes = record_bytes
         self._header_bytes = None
-        self._fields = IndexDict()
-        self._parse()
+        self._fields = []
+        self._fields_end = 0
 
     def __bytes__(self):
         return self._bytes
@@ -61,86 +76,110 @@ class Record(object):
     def fields(self):
         return self._fields
 
+    @property
+    def values(self):
+        return tuple(map(_FIELD_VALUE, self._fields))
+
     def truncate(self, new_length):
         self._bytes = self._bytes[:new_length]
-        self._parse()
+        # Fields hold their own bytes, so they only need rebuilding if some of
+        # them were cut off
+        if new_length < self._fields_end:
+            self._parse()
+
+    @classmethod
+    def try_parse(cls, record_bytes):
+        # Most candidate records carved out of freeblocks by the heuristics
+        # are garbage, don't pay for raising and unwinding an exception for
+        # every one of them
+        record_obj = cls.__new__(cls)
+        record_obj._init(record_bytes)
+        if record_obj._parse_fields() is not None:
+            return None
+        return record_obj
 
     def _parse(self):
+        error = self._parse_fields()
+        if error is not None:
+            raise MalformedRecord(error)
+
+    def _parse_fields(self):
+        # Returns None on success or a description of the problem otherwise
+        record_bytes = self._bytes
         header_offset = 0
 
-        header_length_varint = Varint(
-            # A varint is encoded on *at most* 9 bytes
-            bytes(self)[header_offset:9 + header_offset]
+        header_length, varint_length = decode_varint(
+            record_bytes, header_offset
         )
 
         # Let's keep track of how many bytes of the Record header (including
         # the header length itself) we've succesfully parsed
-        parsed_header_bytes = len(header_length_varint)
-
-        if len(bytes(self)) < int(header_length_varint):
-            raise MalformedRecord(
-                "Not enough bytes to fully read the record header!"
-            )
-
-        header_offset += len(header_length_varint)
-        self._header_bytes = bytes(self)[:int(header_length_varint)]
+        parsed_header_bytes = varint_length
+
+        if len(record_bytes) < header_length:
+            return "Not enough bytes to fully read the record header!"
+
+        header_offset += varint_length
+        self._header_bytes = record_bytes[:header_length]
+
+        # Every row of a table with a fixed schema tends to have the same
+        # header, and identical headers lay fields out identically
+        layout = _HEADER_LAYOUTS.get(self._header_bytes)
+        if layout is None:
+            layout = []
+            fixed_lengths = _FIXED_SERIAL_TYPE_LENGTHS
+            field_offset = header_length
+            while header_offset < header_length:
+                serial_type, varint_length = decode_varint(
+                    record_bytes, header_offset
+                )
 
-        col_idx = 0
-        field_offset = int(header_length_varint)
-        while header_offset < int(header_length_varint):
-            serial_type_varint = Varint(
-                bytes(self)[header_offset:9 + header_offset]
-            )
-            serial_type = int(serial_type_varint)
-            col_length = None
-
-            try:
-                col_length, _ = self.column_types[serial_type]
-            except KeyError as col_type_ex:
-                if serial_type >= 13 and (1 == serial_type % 2):
-                    col_length = (serial_type - 13) // 2
-                elif serial_type >= 12 and (0 == serial_type % 2):
+                if serial_type >= 12:
+                    # BLOBs (even) and strings (odd) encode their length in
+                    # the serial type
                     col_length = (serial_type - 12) // 2
+                elif 0 <= serial_type < len(fixed_lengths):
+                    col_length = fixed_lengths[serial_type]
                 else:
-                    raise ValueError(
-                        "Unknown serial type {}".format(serial_type)
-                    ) from col_type_ex
-
-            try:
-                field_obj = Field(
-                    col_idx,
-                    serial_type,
-                    bytes(self)[field_offset:field_offset + col_length]
-                )
-            except MalformedField as ex:
-                _LOGGER.warning(
-                    "Caught %r while instantiating field %d (%d)",
-                    ex, col_idx, serial_type
-                )
-                raise MalformedRecord from ex
-            except Exception as ex:
-                _LOGGER.warning(
-                    "Caught %r while instantiating field %d (%d)",
-                    ex, col_idx, serial_type
+                    return "Unknown serial type {}".format(serial_type)
+
+                field_end = field_offset + col_length
+                layout.append((serial_type, field_offset, field_end))
+                field_offset = field_end
+
+                parsed_header_bytes += varint_length
+                header_offset += varint_length
+
+            layout = tuple(layout)
+            # A last varint running past the end of the header depends on
+            # more than the header bytes
+            if (header_offset == header_length and
+                    len(_HEADER_LAYOUTS) < _MAX_HEADER_LAYOUTS):
+                _HEADER_LAYOUTS[self._header_bytes] = layout
+
+        field_offset = layout[-1][2] if layout else header_length
+        if field_offset > len(record_bytes):
+            return "Fields overrun the record"
+
+        fields = self._fields = []
+        try_field = Field.try_from
+        for col_idx, (serial_type, field_start, field_end) in enumerate(
+                layout):
+            field_obj = try_field(
+                col_idx, serial_type, record_bytes[field_start:field_end]
+            )
+            if field_obj is None:
+                return "Malformed field {} (serial type {})".format(
+                    col_idx, serial_type
                 )
-                # pdb.set_trace()
-                raise
+            fields.append(field_obj)
 
-            self._fields[col_idx] = field_obj
-            col_idx += 1
-            field_offset += col_length
-
-            parsed_header_bytes += len(serial_type_varint)
-            header_offset += len(serial_type_varint)
-
-            if field_offset > len(bytes(self)):
-                raise MalformedRecord
-
-        # assert(parsed_header_bytes == int(header_length_varint))
+        self._fields_end = field_offset
+        # assert(parsed_header_bytes == header_length)
+        return None
 
     def print_fields(self, table=None):
-        for field_idx in self._fields:
-            field_obj = self._fields[field_idx]
+        for field_obj in self._fields:
             if not table or table.columns is None:
                 _LOGGER.info(
                     "\tField %d (%d bytes), type %d: %s",
@@ -158,5 +197,13 @@ class Record(object):
 
     def __repr__(self):
         return '<Record {} fields, {} bytes, header: {} bytes>'.format(
-            len(self._fields), len(bytes(self)), len(self.header)
+            len(self._fields), len(self._bytes), len(self.header)
         )
+
+
+# Serial types 0-9 have a fixed length, indexing a tuple is cheaper than a
+# dict lookup in Record._parse()
+_FIXED_SERIAL_TYPE_LENGTHS = tuple(
+    Record.column_types[serial_type][0]
+    for serial_type in range(len(Record.column_types))
+)
@@ -38,14 +38,15 @@ def gen_output_dir(db_path):
     db_dir, db_name = os.path.split(db_abspath)
 
     munged_name = db_name.replace('.', '_')
-    out_dir = os.path.join(db_dir, munged_name)
-    if not os.path.exists(out_dir):
-        return out_dir
+    # List the directory once rather than probing each candidate name
+    existing_entries = set(os.listdir(db_dir))
+    if munged_name not in existing_entries:
+        return os.path.join(db_dir, munged_name)
     suffix = 1
     while suffix <= 10:
-        out_dir = os.path.join(db_dir, "{}_{}".format(munged_name, suffix))
-        if not os.path.exists(out_dir):
-            return out_dir
+        out_name = "{}_{}".format(munged_name, suffix)
+        if out_name not in existing_entries:
+            return os.path.join(db_dir, out_name)
         suffix += 1
     raise SystemError(
         "Unreasonable number of output directories for {}".format(db_path)
@@ -75,8 +76,10 @@ def _load_db(sqlite_path):
     db.reparent_orphaned_table_leaf_pages()
 
     # All pages should now be represented by specialised objects
-    assert(all(isinstance(p, Page) for p in db.pages.values()))
-    assert(not any(type(p) is Page for p in db.pages.values()))
+    assert(len(db.pages) == db.header.size_in_pages)
+    assert all(
+        isinstance(p, Page) and type(p) is not Page for p in db.pages.values()
+    )
     return db
 
 
@@ -95,6 +98,37 @@ def dump_to_csv(args):
         table.csv_dump(out_dir)
 
 
+_INSERT_ERRORS = (
+    sqlite3.IntegrityError,
+    sqlite3.ProgrammingError,
+    sqlite3.OperationalError,
+    sqlite3.InterfaceError,
+)
+
+
+def _insert_one_at_a_time(cursor, table, insert_statement, rows):
+    failed_inserts = 0
+    constraint_violations = 0
+    successful_inserts = 0
+    for values in rows:
+        try:
+            cursor.execute(insert_statement, values)
+        except sqlite3.IntegrityError:
+            # We gotta soldier on, there's not much we can do if a
+            # constraint is violated by this insert
+            constraint_violations += 1
+        except _INSERT_ERRORS as insert_ex:
+            _LOGGER.warning(
+                "Caught %r while executing INSERT statement in \"%s\"",
+                insert_ex,
+                table
+            )
+            failed_inserts += 1
+        else:
+            successful_inserts += 1
+    return failed_inserts, constraint_violations, successful_inserts
+
+
 def undelete(args):
     db_abspath = os.path.abspath(args.sqlite_path)
     db = _load_db(db_abspath)
@@ -105,45 +139,50 @@ def undelete(args):
 
     shutil.copyfile(db_abspath, output_path)
     with sqlite3.connect(output_path) as output_db_connection:
+        # The output is a throwaway copy of the input, there's no point in
+        # paying for durability while we fill it in
+        output_db_connection.execute('PRAGMA journal_mode=MEMORY')
+        output_db_connection.execute('PRAGMA synchronous=OFF')
+        output_db_connection.execute('PRAGMA temp_store=MEMORY')
         cursor = output_db_connection.cursor()
+        # Every table's records go into the same transaction, which gets
+        # committed when the connection's context manager exits. Each table
+        # still gets its own savepoint below
+        cursor.execute('BEGIN')
         for table_name in sorted(db.tables):
             table = db.tables[table_name]
             _LOGGER.info("Table \"%s\"", table)
             table.recover_records(args.database_name)
 
-            failed_inserts = 0
-            constraint_violations = 0
-            successful_inserts = 0
+            # All of a table's INSERT statements are the same, only the values
+            # differ
+            insert_statement = None
+            rows = []
             for leaf_page in table.leaves:
-                if not leaf_page.recovered_records:
-                    continue
-
                 for record in leaf_page.recovered_records:
                     insert_statement, values = table.build_insert_SQL(record)
+                    rows.append(values)
 
-                    try:
-                        cursor.execute(insert_statement, values)
-                    except sqlite3.IntegrityError:
-                        # We gotta soldier on, there's not much we can do if a
-                        # constraint is violated by this insert
-                        constraint_violations += 1
-                    except (
-                                sqlite3.ProgrammingError,
-                                sqlite3.OperationalError,
-                                sqlite3.InterfaceError
-                            ) as insert_ex:
-                        _LOGGER.warning(
-                            (
-                                "Caught %r while executing INSERT statement "
-                                "in \"%s\""
-                            ),
-                            insert_ex,
-                            table
+            failed_inserts = 0
+            constraint_violations = 0
+            successful_inserts = 0
+            if rows:
+                # Insert the whole table's worth of records at once. If any of
+                # them fails, undo the batch and go one record at a time so
+                # that we know which ones didn't make it
+                cursor.execute('SAVEPOINT recovered_records')
+                try:
+                    cursor.executemany(insert_statement, rows)
+                except _INSERT_ERRORS:
+                    cursor.execute('ROLLBACK TO recovered_records')
+                    failed_inserts, constraint_violations, \
+                        successful_inserts = _insert_one_at_a_time(
+                            cursor, table, insert_statement, rows
                         )
-                        failed_inserts += 1
-                        # pdb.set_trace()
-                    else:
-                        successful_inserts += 1
+                else:
+                    successful_inserts = len(rows)
+                cursor.execute('RELEASE recovered_records')
+
             if failed_inserts > 0:
                 _LOGGER.warning(
                     "%d failed INSERT statements in \"%s\"",
@@ -20,9 +20,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import collections
 import csv
+import logging
 import os
-import tempfile
 
 from . import _LOGGER
 from .record import Record
@@ -34,6 +35,7 @@ class Table(object):
         self._name = name
         self._db = db
         self._signatures = signatures
+        self._signature_matches = {}
         assert(isinstance(rootpage, BTreePage))
         self._root = rootpage
         self._leaves = []
@@ -41,6 +43,8 @@ class Table(object):
             self._columns = self._db.table_columns[self.name]
         except KeyError:
             self._columns = None
+        # Built the first time a record is turned into an INSERT statement
+        self._insert_statement = None
 
         # We want this to be a list of leaf-type pages, sorted in the order of
         # their smallest rowid
@@ -76,17 +80,16 @@ class Table(object):
                 )
                 table_pages.append(rightmost_page)
 
-        page_queue = list(table_pages)
+        page_queue = collections.deque(table_pages)
         while page_queue:
-            table_page = page_queue.pop(0)
+            table_page = page_queue.popleft()
             # table_pages is initialised with the table's rootpage, which
             # may be a leaf page for a very small table
             if table_page.page_type != 'Table Interior':
                 self._leaves.append(table_page)
                 continue
 
-            for cell_idx in table_page.cells:
-                page_ptr, max_row_in_page = table_page.cells[cell_idx]
+            for page_ptr, max_row_in_page in table_page.cells:
 
                 page = self._db.pages[page_ptr]
                 _LOGGER.debug("B-Tree cell: (%r, %d)", page, max_row_in_page)
@@ -102,15 +105,23 @@ class Table(object):
 
     @property
     def leaves(self):
-        for leaf_page in self._leaves:
-            yield leaf_page
+        return self._leaves
 
     def recover_records(self, grouping):
-        for page in self.leaves:
-            assert isinstance(page, BTreePage)
-            if not page.freeblocks:
-                continue
+        pages = [page for page in self.leaves if page.freeblocks]
+        assert all(isinstance(page, BTreePage) for page in pages)
+        if not pages:
+            return
+
+        # All of this table's pages use the same heuristic, there's no point
+        # in looking at any of them if there isn't one
+        try:
+            self._db.heuristics_registry.get_heuristic(self, grouping)
+        except ValueError as ex:
+            _LOGGER.error(str(ex))
+            return
 
+        for page in pages:
             _LOGGER.info("%r", page)
             page.recover_freeblock_records(grouping)
             page.print_recovered_records()
@@ -121,79 +132,99 @@ class Table(object):
             raise ValueError("Output file {} exists!".format(csv_path))
 
         _LOGGER.info("Dumping table \"%s\" to CSV", self.name)
-        with tempfile.TemporaryFile('w+', newline='') as csv_temp:
-            writer = csv.DictWriter(csv_temp, fieldnames=self._columns)
-            writer.writeheader()
-
-            for leaf_page in self.leaves:
-                for cell_idx in leaf_page.cells:
-                    rowid, record = leaf_page.cells[cell_idx]
-                    # assert(self.check_signature(record))
-
+        # Write to a temporary name so that an interrupted dump doesn't leave
+        # a partial CSV file that looks complete
+        partial_path = csv_path + '.partial'
+        csv_file = open(partial_path, 'w', newline='', encoding='UTF8')
+        try:
+            with csv_file:
+                self._write_csv(csv_file)
+        except BaseException:
+            # Don't leave the partial file lying around either
+            os.remove(partial_path)
+            raise
+        os.replace(partial_path, csv_path)
+
+    def _write_csv(self, csv_file):
+        writer = csv.writer(csv_file)
+        writer.writerow(self._columns)
+
+        # Don't build the per-record debug messages unless they're going
+        # to be emitted
+        debug = _LOGGER.isEnabledFor(logging.DEBUG)
+        for leaf_page in self.leaves:
+            if debug:
+                for rowid, record in leaf_page.cells:
                     _LOGGER.debug('Record %d: %r', rowid, record.header)
-                    fields_iter = (
-                        repr(record.fields[idx]) for idx in record.fields
-                    )
-                    _LOGGER.debug(', '.join(fields_iter))
-
-                    values_iter = (
-                        record.fields[idx].value for idx in record.fields
+                    _LOGGER.debug(
+                        ', '.join(repr(field) for field in record.fields)
                     )
-                    writer.writerow(dict(zip(self._columns, values_iter)))
 
-                if not leaf_page.recovered_records:
-                    continue
+            writer.writerows(
+                self._padded_values(record)
+                for _, record in leaf_page.cells
+            )
 
-                # Recovered records are in an unordered set because their rowid
-                # has been lost, making sorting impossible
-                for record in leaf_page.recovered_records:
-                    values_iter = (
-                        record.fields[idx].value for idx in record.fields
-                    )
-                    writer.writerow(dict(zip(self._columns, values_iter)))
+            if not leaf_page.recovered_records:
+                continue
 
-            if csv_temp.tell() > 0:
-                csv_temp.seek(0)
-                with open(csv_path, 'w', encoding='UTF8') as csv_file:
-                    csv_file.write(csv_temp.read())
+            # Recovered records have lost their rowid, making sorting
+            # impossible. They're listed in the order they were found in
+            writer.writerows(
+                map(self._padded_values, leaf_page.recovered_records)
+            )
+
+    def _padded_values(self, record):
+        values = record.values
+        num_columns = len(self._columns)
+        if len(values) != num_columns:
+            # Records with fewer fields than the table has columns are padded
+            # with NULLs
+            values = (values + (None,) * num_columns)[:num_columns]
+        return values
 
     def build_insert_SQL(self, record):
-        column_placeholders = (
-            ':' + col_name for col_name in self._columns
-        )
-        insert_statement = 'INSERT INTO {} VALUES ({})'.format(
-            self.name,
-            ', '.join(c for c in column_placeholders),
-        )
-        value_kwargs = {}
-        for col_idx, col_name in enumerate(self._columns):
-            try:
-                if record.fields[col_idx].value is None:
-                    value_kwargs[col_name] = None
-                else:
-                    value_kwargs[col_name] = record.fields[col_idx].value
-            except KeyError:
-                value_kwargs[col_name] = None
-
-        return insert_statement, value_kwargs
+        insert_statement = self._insert_statement
+        if insert_statement is None:
+            insert_statement = self._insert_statement = (
+                'INSERT INTO {} VALUES ({})'.format(
+                    self.name,
+                    ', '.join('?' * len(self._columns)),
+                )
+            )
+        # Values are bound positionally, in column order
+        return insert_statement, self._padded_values(record)
 
     def check_signature(self, record):
         assert isinstance(record, Record)
+        # Whether a record fits this table's signature only depends on the
+        # types of its values
+        value_types = tuple(map(type, record.values))
+        try:
+            return self._signature_matches[value_types]
+        except KeyError:
+            pass
+
+        signature_match = self._check_signature(value_types)
+        self._signature_matches[value_types] = signature_match
+        return signature_match
+
+    def _check_signature(self, value_types):
         try:
             sig = self._signatures[self.name]
         except KeyError:
             # The sqlite schema tables don't have a signature (or need one)
             return True
-        if len(record.fields) > len(self.columns):
+        if len(value_types) > len(self.columns):
             return False
 
         # It's OK for a record to have fewer fields than there are columns in
         # this table, this is seen when NULLable or default-valued columns are
         # added in an ALTER TABLE statement.
-        for field_idx, field in record.fields.items():
+        for field_idx, value_type in enumerate(value_types):
             # NULL can be a value for any column type
-            if field.value is None:
+            if value_type is type(None):
                 continue
-            if not isinstance(field.value, sig[field_idx]):
+            if not issubclass(value_type, sig[field_idx]):
                 return False
         return True
@@ -21,28 +21,47 @@
 # SOFTWARE.
 
 
-class Varint(object):
-    def __init__(self, varint_bytes):
-        self._bytes = varint_bytes
-        self._len = 0
-        self._value = 0
+def decode_varint(varint_bytes, offset=0):
+    # A varint is encoded on *at most* 9 bytes. The first 8 bytes contribute
+    # their lower 7 bits, the 9th byte contributes all 8 of its bits
+    #
+    # Serial types and most lengths fit in a single byte, don't bother with
+    # the loop for those
+    buffer_len = len(varint_bytes)
+    if offset < buffer_len:
+        first_byte = varint_bytes[offset]
+        if first_byte < 0x80:
+            return first_byte, 1
+        # Payload sizes and rowids mostly fit in two bytes
+        if offset + 1 < buffer_len:
+            second_byte = varint_bytes[offset + 1]
+            if second_byte < 0x80:
+                return ((first_byte & 0x7F) << 7) | second_byte, 2
 
-        varint_bits = []
-        for b in self._bytes:
-            self._len += 1
-            if b & 0x80:
-                varint_bits.append(b & 0x7F)
-            else:
-                varint_bits.append(b)
-                break
+    value = 0
+    idx = offset
+    end = min(offset + 8, buffer_len)
+    while idx < end:
+        byte = varint_bytes[idx]
+        idx += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            break
+    else:
+        if idx == offset + 8 and idx < buffer_len:
+            value = (value << 8) | varint_bytes[idx]
+            idx += 1
 
-        varint_twos_complement = 0
-        for position, b in enumerate(varint_bits[::-1]):
-            varint_twos_complement += b * (1 << (7*position))
+    # Varints hold 64-bit twos-complement integers
+    if value & 0x8000000000000000:
+        value -= 0x10000000000000000
+    return value, idx - offset
 
-        self._value = decode_twos_complement(
-            int.to_bytes(varint_twos_complement, 4, byteorder='big'), 64
-        )
+
+class Varint(object):
+    def __init__(self, varint_bytes):
+        self._bytes = varint_bytes
+        self._value, self._len = decode_varint(varint_bytes)
 
     def __int__(self):
         return self._value
@@ -52,17 +71,3 @@ class Varint(object):
 
     def __repr__(self):
         return "<Varint {} ({} bytes)>".format(int(self), len(self))
-
-
-class IndexDict(dict):
-    def __iter__(self):
-        for k in sorted(self.keys()):
-            yield k
-
-
-def decode_twos_complement(encoded, bit_length):
-    assert(0 == bit_length % 8)
-    encoded_int = int.from_bytes(encoded, byteorder='big')
-    mask = 2**(bit_length - 1)
-    value = -(encoded_int & mask) + (encoded_int & ~mask)
-    return value